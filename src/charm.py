@@ -4,37 +4,89 @@
 
 """Charmed operator for the 5G AUSF service."""
 
+import copy
+import hashlib
+import io
 import logging
-from ipaddress import IPv4Address
-from subprocess import check_output
-from typing import Optional, Union
+import os
+from functools import cached_property, lru_cache
+from ipaddress import IPv4Address, IPv6Address
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
 
-from charms.nrf_operator.v0.nrf import NRFAvailableEvent, NRFRequires
+from charms.nrf_operator.v0.nrf import NRFRequires
 from charms.observability_libs.v1.kubernetes_service_patch import KubernetesServicePatch
-from jinja2 import Environment, FileSystemLoader
 from lightkube.models.core_v1 import ServicePort
-from ops.charm import CharmBase, PebbleReadyEvent
+from ops.charm import CharmBase
+from ops.framework import EventBase, StoredState
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from ops.pebble import Layer
 
+if TYPE_CHECKING:
+    from jinja2 import Template
+
 logger = logging.getLogger(__name__)
 
 BASE_CONFIG_PATH = "/etc/ausf"
 CONFIG_FILE_NAME = "ausfcfg.conf"
 
+_AUSF_LAYER_STATIC = {
+    "summary": "ausf layer",
+    "description": "pebble config layer for ausf",
+    "services": {
+        "ausf": {
+            "override": "replace",
+            "startup": "enabled",
+            "command": f"/free5gc/ausf/ausf --ausfcfg {BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}",
+        },
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def _get_ausfcfg_template(bytecode_cache_dir: Path) -> "Template":
+    """Returns the compiled AUSF config template.
+
+    Jinja2 is only imported the first time a config file needs to be rendered, so hooks that
+    never reach that point don't pay for it. Juju re-executes the charm on every hook, so
+    compiled template bytecode is persisted on disk to skip the lex/parse/codegen step on
+    subsequent hooks.
+
+    Args:
+        bytecode_cache_dir (Path): Directory where compiled template bytecode is stored.
+
+    Returns:
+        Template: AUSF config template.
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    os.makedirs(bytecode_cache_dir, mode=0o700, exist_ok=True)
+    jinja2_environment = Environment(
+        loader=FileSystemLoader("src/templates/"),
+        auto_reload=False,
+        cache_size=-1,
+        bytecode_cache=FileSystemBytecodeCache(
+            directory=str(bytecode_cache_dir), pattern="__ausf_jinja2_%s.cache"
+        ),
+    )
+    return jinja2_environment.get_template("ausfcfg.conf.j2")
+
 
 class AUSFOperatorCharm(CharmBase):
     """Main class to describe juju event handling for the 5G AUSF operator."""
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
+        self._stored.set_default(config_hash="")
         self._container_name = self._service_name = "ausf"
         self._container = self.unit.get_container(self._container_name)
         self._nrf_requires = NRFRequires(charm=self, relationship_name="nrf")
-        self.framework.observe(self.on.ausf_pebble_ready, self._on_ausf_pebble_ready)
-        self.framework.observe(self._nrf_requires.on.nrf_available, self._on_ausf_pebble_ready)
-        self.framework.observe(self.on.nrf_relation_joined, self._on_ausf_pebble_ready)
+        self.framework.observe(self.on.ausf_pebble_ready, self._reconcile)
+        self.framework.observe(self._nrf_requires.on.nrf_available, self._reconcile)
+        self.framework.observe(self.on.nrf_relation_joined, self._reconcile)
         self._service_patcher = KubernetesServicePatch(
             charm=self,
             ports=[
@@ -42,25 +94,30 @@ class AUSFOperatorCharm(CharmBase):
             ],
         )
 
-    def _write_config_file(self, nrf_url: str) -> None:
-        jinja2_environment = Environment(loader=FileSystemLoader("src/templates/"))
-        template = jinja2_environment.get_template("ausfcfg.conf.j2")
-        content = template.render(
-            nrf_url=nrf_url,
-            ausf_url=self._ausf_hostname,
-        )
-        self._container.push(path=f"{BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}", source=content)
-        logger.info(f"Pushed {CONFIG_FILE_NAME} config file")
+    def _write_config_file(self, nrf_url: str) -> bool:
+        """Renders the AUSF config file and pushes it to the workload if its content changed.
 
-    @property
-    def _nrf_data_is_available(self) -> bool:
-        """Returns whether the NRF data is available.
+        Args:
+            nrf_url (str): URL of the NRF.
 
         Returns:
-            bool: Whether the NRF data is available.
+            bool: Whether the config file was pushed.
         """
-        if not self._nrf_requires.get_nrf_url():
+        content = _get_ausfcfg_template(self._template_cache_dir).render(
+            nrf_url=nrf_url,
+            ausf_url=self._ausf_hostname,
+        )
+        config_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if config_hash == self._stored.config_hash and self._config_file_is_written:
+            logger.info(f"Config file {CONFIG_FILE_NAME} is up to date")
             return False
+        self._container.push(
+            path=f"{BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}",
+            source=io.BytesIO(content.encode("utf-8")),
+            make_dirs=True,
+        )
+        self._stored.config_hash = config_hash
+        logger.info(f"Pushed {CONFIG_FILE_NAME} config file")
         return True
 
     @property
@@ -71,7 +128,27 @@ class AUSFOperatorCharm(CharmBase):
         logger.info("Config file is written")
         return True
 
-    def _on_ausf_pebble_ready(self, event: Union[PebbleReadyEvent, NRFAvailableEvent]) -> None:
+    @property
+    def _pebble_layer_is_applied(self) -> bool:
+        """Returns whether the ausf service in the Pebble plan matches the charm's layer.
+
+        Returns:
+            bool: Whether the Pebble plan is up to date.
+        """
+        plan_services = self._container.get_plan().to_dict().get("services", {})
+        layer_services = self._pebble_layer.to_dict()["services"]
+        return plan_services.get(self._service_name) == layer_services[self._service_name]
+
+    def _reconcile(self, event: EventBase) -> None:
+        """Brings the workload in line with the current relation data.
+
+        All observed events converge on this handler, and the config file is only re-pushed
+        when its rendered content differs from the last one pushed. The service is restarted
+        when a new config file is pushed under an unchanged Pebble layer.
+
+        Args:
+            event (EventBase): Juju event.
+        """
         if not self._nrf_relation_is_created:
             self.unit.status = BlockedStatus("Waiting for NRF relation to be created")
             return
@@ -79,15 +156,23 @@ class AUSFOperatorCharm(CharmBase):
             self.unit.status = WaitingStatus("Waiting for container to be ready")
             event.defer()
             return
-        if not self._nrf_data_is_available:
+        nrf_url = self._nrf_requires.get_nrf_url()
+        if not nrf_url:
             self.unit.status = WaitingStatus("Waiting for NRF data to be available")
             return
-        if not self._config_file_is_written:
-            self._write_config_file(
-                nrf_url=self._nrf_requires.get_nrf_url(),
-            )
-        self._container.add_layer("ausf", self._pebble_layer, combine=True)
-        self._container.replan()
+        if self._pod_ip is None:
+            self.unit.status = WaitingStatus("Waiting for pod IP address to be available")
+            event.defer()
+            return
+        config_file_pushed = self._write_config_file(
+            nrf_url=nrf_url,
+        )
+        if not self._pebble_layer_is_applied:
+            self._container.add_layer("ausf", self._pebble_layer, combine=True)
+            self._container.replan()
+        elif config_file_pushed:
+            self._container.restart(self._service_name)
+            logger.info(f"Restarted {self._service_name} to load the new config file")
         self.unit.status = ActiveStatus()
 
     @property
@@ -107,29 +192,18 @@ class AUSFOperatorCharm(CharmBase):
             return False
         return True
 
-    @property
+    @cached_property
     def _pebble_layer(self) -> Layer:
         """Returns pebble layer for the charm.
 
         Returns:
             Layer: Pebble Layer
         """
-        return Layer(
-            {
-                "summary": "ausf layer",
-                "description": "pebble config layer for ausf",
-                "services": {
-                    "ausf": {
-                        "override": "replace",
-                        "startup": "enabled",
-                        "command": f"/free5gc/ausf/ausf --ausfcfg {BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}",
-                        "environment": self._environment_variables,
-                    },
-                },
-            }
-        )
+        layer = copy.deepcopy(_AUSF_LAYER_STATIC)
+        layer["services"]["ausf"]["environment"] = self._environment_variables
+        return Layer(layer)
 
-    @property
+    @cached_property
     def _environment_variables(self) -> dict:
         return {
             "GRPC_GO_LOG_VERBOSITY_LEVEL": "99",
@@ -140,12 +214,26 @@ class AUSFOperatorCharm(CharmBase):
             "MANAGED_BY_CONFIG_POD": "true",
         }
 
-    @property
-    def _pod_ip(self) -> Optional[IPv4Address]:
-        """Get the IP address of the Kubernetes pod."""
-        return IPv4Address(check_output(["unit-get", "private-address"]).decode().strip())
+    @cached_property
+    def _pod_ip(self) -> Optional[Union[IPv4Address, IPv6Address, str]]:
+        """Get the IP address of the Kubernetes pod.
+
+        Returns:
+            Optional[Union[IPv4Address, IPv6Address, str]]: Bind address of the juju-info
+                binding, or None if Juju has not assigned one to the pod yet.
+        """
+        return self.model.get_binding("juju-info").network.bind_address
 
     @property
+    def _template_cache_dir(self) -> Path:
+        """Returns the directory where compiled Jinja2 templates are cached.
+
+        Returns:
+            Path: Template bytecode cache directory, owned by the charm.
+        """
+        return self.charm_dir / ".jinja2-cache"
+
+    @cached_property
     def _ausf_hostname(self) -> str:
         return f"{self.model.app.name}.{self.model.name}.svc.cluster.local"
 
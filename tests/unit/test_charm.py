@@ -1,27 +1,50 @@
 # Copyright 2022 Guillaume Belanger
 # See LICENSE file for licensing details.
 
+import tempfile
 import unittest
-from unittest.mock import patch
+from ipaddress import IPv4Address
+from pathlib import Path
+from typing import Optional
+from unittest.mock import Mock, PropertyMock, patch
 
 from ops import testing
-from ops.model import ActiveStatus
+from ops.model import ActiveStatus, WaitingStatus
 
-from charm import AUSFOperatorCharm
+from charm import AUSFOperatorCharm, _get_ausfcfg_template
 
 
 class TestCharm(unittest.TestCase):
-    @patch(
-        "charm.KubernetesServicePatch",
-        lambda charm, ports: None,
-    )
+    @classmethod
+    def setUpClass(cls):
+        patcher = patch("charm.KubernetesServicePatch", lambda charm, ports: None)
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
     def setUp(self):
+        template_cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(template_cache_dir.cleanup)
+        self.template_cache_dir = Path(template_cache_dir.name)
+        template_cache_dir_patcher = patch.object(
+            AUSFOperatorCharm,
+            "_template_cache_dir",
+            new_callable=PropertyMock,
+            return_value=self.template_cache_dir,
+        )
+        template_cache_dir_patcher.start()
+        self.addCleanup(template_cache_dir_patcher.stop)
         self.namespace = "whatever"
         self.harness = testing.Harness(AUSFOperatorCharm)
         self.harness.set_model_name(name=self.namespace)
         self.addCleanup(self.harness.cleanup)
         self.harness.begin()
 
+    @staticmethod
+    def _binding(bind_address: Optional[str]) -> Mock:
+        binding = Mock()
+        binding.network.bind_address = IPv4Address(bind_address) if bind_address else None
+        return binding
+
     def _nrf_is_available(self) -> str:
         nrf_url = "http://1.1.1.1"
         nrf_relation_id = self.harness.add_relation("nrf", "nrf-operator")
@@ -33,33 +56,99 @@ class TestCharm(unittest.TestCase):
         )
         return nrf_url
 
-    @patch("charm.check_output")
+    @patch("ops.model.Model.get_binding")
     @patch("ops.model.Container.push")
     def test_given_nrf_is_available_when_databases_are_created_then_config_file_is_written(
         self,
         patch_push,
-        patch_check_output,
+        patch_get_binding,
     ):
-        patch_check_output.return_value = b"1.2.3.4"
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
         self.harness.set_can_connect(container="ausf", val=True)
 
         nrf_url = self._nrf_is_available()
 
-        patch_push.assert_called_with(
-            path="/etc/ausf/ausfcfg.conf",
-            source=f'configuration:\n  groupId: ausfGroup001\n  nrfUri: { nrf_url }\n  plmnSupportList:\n  - mcc: "208"\n    mnc: "93"\n  sbi:\n    bindingIPv4: 0.0.0.0\n    port: 29509\n    registerIPv4: ausf-operator.whatever.svc.cluster.local\n    scheme: http\n  serviceNameList:\n  - nausf-auth\ninfo:\n  description: AUSF initial local configuration\n  version: 1.0.0\nlogger:\n  AMF:\n    ReportCaller: false\n    debugLevel: info\n  AUSF:\n    ReportCaller: false\n    debugLevel: info\n  Aper:\n    ReportCaller: false\n    debugLevel: info\n  CommonConsumerTest:\n    ReportCaller: false\n    debugLevel: info\n  FSM:\n    ReportCaller: false\n    debugLevel: info\n  MongoDBLibrary:\n    ReportCaller: false\n    debugLevel: info\n  N3IWF:\n    ReportCaller: false\n    debugLevel: info\n  NAS:\n    ReportCaller: false\n    debugLevel: info\n  NGAP:\n    ReportCaller: false\n    debugLevel: info\n  NRF:\n    ReportCaller: false\n    debugLevel: info\n  NamfComm:\n    ReportCaller: false\n    debugLevel: info\n  NamfEventExposure:\n    ReportCaller: false\n    debugLevel: info\n  NsmfPDUSession:\n    ReportCaller: false\n    debugLevel: info\n  NudrDataRepository:\n    ReportCaller: false\n    debugLevel: info\n  OpenApi:\n    ReportCaller: false\n    debugLevel: info\n  PCF:\n    ReportCaller: false\n    debugLevel: info\n  PFCP:\n    ReportCaller: false\n    debugLevel: info\n  PathUtil:\n    ReportCaller: false\n    debugLevel: info\n  SMF:\n    ReportCaller: false\n    debugLevel: info\n  UDM:\n    ReportCaller: false\n    debugLevel: info\n  UDR:\n    ReportCaller: false\n    debugLevel: info\n  WEBUI:\n    ReportCaller: false\n    debugLevel: info',  # noqa: E501
+        kwargs = patch_push.call_args.kwargs
+        self.assertEqual(kwargs["path"], "/etc/ausf/ausfcfg.conf")
+        self.assertTrue(kwargs["make_dirs"])
+        self.assertEqual(
+            kwargs["source"].getvalue().decode("utf-8"),
+            f'configuration:\n  groupId: ausfGroup001\n  nrfUri: { nrf_url }\n  plmnSupportList:\n  - mcc: "208"\n    mnc: "93"\n  sbi:\n    bindingIPv4: 0.0.0.0\n    port: 29509\n    registerIPv4: ausf-operator.whatever.svc.cluster.local\n    scheme: http\n  serviceNameList:\n  - nausf-auth\ninfo:\n  description: AUSF initial local configuration\n  version: 1.0.0\nlogger:\n  AMF:\n    ReportCaller: false\n    debugLevel: info\n  AUSF:\n    ReportCaller: false\n    debugLevel: info\n  Aper:\n    ReportCaller: false\n    debugLevel: info\n  CommonConsumerTest:\n    ReportCaller: false\n    debugLevel: info\n  FSM:\n    ReportCaller: false\n    debugLevel: info\n  MongoDBLibrary:\n    ReportCaller: false\n    debugLevel: info\n  N3IWF:\n    ReportCaller: false\n    debugLevel: info\n  NAS:\n    ReportCaller: false\n    debugLevel: info\n  NGAP:\n    ReportCaller: false\n    debugLevel: info\n  NRF:\n    ReportCaller: false\n    debugLevel: info\n  NamfComm:\n    ReportCaller: false\n    debugLevel: info\n  NamfEventExposure:\n    ReportCaller: false\n    debugLevel: info\n  NsmfPDUSession:\n    ReportCaller: false\n    debugLevel: info\n  NudrDataRepository:\n    ReportCaller: false\n    debugLevel: info\n  OpenApi:\n    ReportCaller: false\n    debugLevel: info\n  PCF:\n    ReportCaller: false\n    debugLevel: info\n  PFCP:\n    ReportCaller: false\n    debugLevel: info\n  PathUtil:\n    ReportCaller: false\n    debugLevel: info\n  SMF:\n    ReportCaller: false\n    debugLevel: info\n  UDM:\n    ReportCaller: false\n    debugLevel: info\n  UDR:\n    ReportCaller: false\n    debugLevel: info\n  WEBUI:\n    ReportCaller: false\n    debugLevel: info',  # noqa: E501
         )
 
-    @patch("charm.check_output")
+    @patch("ops.model.Model.get_binding")
+    @patch("ops.model.Container.exists")
+    @patch("ops.model.Container.push")
+    def test_given_config_file_already_pushed_when_pebble_ready_then_config_file_is_not_pushed_again(
+        self,
+        patch_push,
+        patch_exists,
+        patch_get_binding,
+    ):
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
+        patch_exists.return_value = True
+        self.harness.set_can_connect(container="ausf", val=True)
+        self._nrf_is_available()
+        patch_push.reset_mock()
+
+        self.harness.container_pebble_ready(container_name="ausf")
+
+        patch_push.assert_not_called()
+
+    @patch("ops.model.Model.get_binding")
+    @patch("ops.model.Container.exists")
+    @patch("ops.model.Container.push")
+    def test_given_config_hash_matches_and_config_file_missing_when_pebble_ready_then_config_file_is_pushed(
+        self,
+        patch_push,
+        patch_exists,
+        patch_get_binding,
+    ):
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
+        patch_exists.return_value = True
+        self.harness.set_can_connect(container="ausf", val=True)
+        self._nrf_is_available()
+        patch_push.reset_mock()
+        patch_exists.return_value = False
+
+        self.harness.container_pebble_ready(container_name="ausf")
+
+        patch_push.assert_called_once()
+
+    @patch("ops.model.Model.get_binding")
+    @patch("ops.model.Container.restart")
+    def test_given_pebble_plan_applied_when_nrf_url_changes_then_service_is_restarted(
+        self,
+        patch_restart,
+        patch_get_binding,
+    ):
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
+        self.harness.set_can_connect(container="ausf", val=True)
+        self._nrf_is_available()
+        patch_restart.assert_not_called()
+
+        self.harness.update_relation_data(
+            relation_id=self.harness.model.get_relation("nrf").id,
+            app_or_unit="nrf-operator",
+            key_values={"url": "http://2.2.2.2"},
+        )
+
+        patch_restart.assert_called_once_with("ausf")
+        self.assertIn(
+            "nrfUri: http://2.2.2.2",
+            self.harness.model.unit.get_container("ausf").pull("/etc/ausf/ausfcfg.conf").read(),
+        )
+
+    @patch("ops.model.Model.get_binding")
     @patch("ops.model.Container.exists")
     def test_given_all_relations_are_ready_when_pebble_ready_then_pebble_plan_is_applied(
         self,
         patch_exists,
-        patch_check_output,
+        patch_get_binding,
     ):
         pod_ip = "1.1.1.1"
         patch_exists.return_value = True
-        patch_check_output.return_value = pod_ip.encode()
+        patch_get_binding.return_value = self._binding(bind_address=pod_ip)
 
         self._nrf_is_available()
 
@@ -87,16 +176,68 @@ class TestCharm(unittest.TestCase):
 
         self.assertEqual(expected_plan, updated_plan)
 
-    @patch("charm.check_output")
+    @patch("ops.model.Model.get_binding")
+    @patch("ops.model.Container.exists")
+    @patch("ops.model.Container.replan")
+    def test_given_pebble_plan_already_applied_when_pebble_ready_then_plan_is_not_replanned(
+        self,
+        patch_replan,
+        patch_exists,
+        patch_get_binding,
+    ):
+        patch_exists.return_value = True
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
+        self.harness.set_can_connect(container="ausf", val=True)
+        self._nrf_is_available()
+        patch_replan.reset_mock()
+
+        self.harness.container_pebble_ready(container_name="ausf")
+
+        patch_replan.assert_not_called()
+
+    @patch("ops.model.Model.get_binding")
     @patch("ops.model.Container.exists")
     def test_given_all_relations_are_ready_when_pebble_ready_then_status_is_active(
-        self, patch_exists, patch_check_output
+        self, patch_exists, patch_get_binding
     ):
         patch_exists.return_value = True
-        patch_check_output.return_value = b"1.2.3.4"
+        patch_get_binding.return_value = self._binding(bind_address="1.2.3.4")
 
         self._nrf_is_available()
 
         self.harness.container_pebble_ready("ausf")
 
         self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch("ops.model.Model.get_binding")
+    @patch("ops.model.Container.exists")
+    def test_given_pod_ip_not_available_when_pebble_ready_then_status_is_waiting(
+        self, patch_exists, patch_get_binding
+    ):
+        patch_exists.return_value = True
+        patch_get_binding.return_value = self._binding(bind_address=None)
+
+        self._nrf_is_available()
+
+        self.harness.container_pebble_ready("ausf")
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            WaitingStatus("Waiting for pod IP address to be available"),
+        )
+        self.assertEqual(self.harness.get_container_pebble_plan("ausf").to_dict(), {})
+
+    def test_given_template_already_compiled_when_template_is_loaded_again_then_bytecode_is_read_from_cache(
+        self,
+    ):
+        _get_ausfcfg_template.cache_clear()
+        self.addCleanup(_get_ausfcfg_template.cache_clear)
+        _get_ausfcfg_template(self.template_cache_dir)
+        self.assertTrue(list(self.template_cache_dir.glob("__ausf_jinja2_*.cache")))
+        _get_ausfcfg_template.cache_clear()
+
+        with patch("jinja2.Environment.compile") as patch_compile:
+            template = _get_ausfcfg_template(self.template_cache_dir)
+
+        patch_compile.assert_not_called()
+        self.assertIn("nrfUri: http://1.1.1.1", template.render(nrf_url="http://1.1.1.1"))